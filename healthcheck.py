@@ -1,8 +1,14 @@
+import asyncio
+import json
 import logging
 import math
 import sys
-from datetime import timedelta
-from typing import TextIO, Sequence, Tuple, NoReturn
+import time
+from array import array
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Any, Dict, Iterator, List, Optional, Set, TextIO, Sequence, NoReturn
 
 import attr
 import httpx
@@ -10,52 +16,435 @@ from cached_property import cached_property
 from fire import Fire
 
 
+# Request phases and httpcore trace events that start and end them.
+# Events for HTTP/1.1 and HTTP/2 are prefixed by `http11.` and `http2.`,
+# the prefix is dropped before matching.
+# httpcore resolves DNS inside `connect_tcp`, so `connect` includes DNS lookup.
+PHASES = dict(
+    connect=('connection.connect_tcp.started', 'connection.connect_tcp.complete'),
+    tls=('connection.start_tls.started', 'connection.start_tls.complete'),
+    ttfb=('send_request_headers.started', 'receive_response_headers.complete'),
+    download=('receive_response_body.started', 'receive_response_body.complete'),
+)
+
+
 @attr.s(auto_attribs=True, kw_only=True)
 class BaseCommand:
     stream: TextIO = sys.stdout
+    # output format: `text` or `json` (one JSON object per line)
+    format: str = 'text'
 
     def _print(self, *args):
         print(*args, file=self.stream)
 
+    def _emit(self, record: Dict[str, Any], text: Optional[str] = None) -> None:
+        """Print the record as a JSON line or as human-readable text.
+
+        In text mode, `text` is printed if passed, otherwise `key: value` lines.
+        """
+        if self.format == 'json':
+            self._print(json.dumps(record))
+            return
+        if text is not None:
+            self._print(text)
+            return
+        for key, value in record.items():
+            self._print(key.replace('_', ' ') + ':', value)
+
+
+@attr.s(auto_attribs=True, kw_only=True)
+class LatencyHistogram:
+    """Streaming HDR-style histogram of latencies in microseconds.
+
+    Values below `2 ** precision` get a bucket each, bigger values
+    get `2 ** (precision - 1)` buckets per power of two, so the relative
+    error of any reported value is below `2 ** (1 - precision)`.
+    Memory is fixed on creation and doesn't depend on the samples count.
+    """
+    precision: int = 7
+    highest: int = 10 ** 9  # ~16 minutes
+
+    total: int = 0
+    max: int = 0
+    _mean: float = 0.0
+    _squares: float = 0.0
+    _buckets: array = attr.ib(init=False)
+
+    def __attrs_post_init__(self) -> None:
+        size = self._index(self.highest) + 1
+        self._buckets = array('Q', bytes(8 * size))
+
+    def _index(self, value: int) -> int:
+        magnitude = value.bit_length() - self.precision
+        if magnitude <= 0:
+            return value
+        half = 1 << (self.precision - 1)
+        return magnitude * half + (value >> magnitude)
+
+    def _upper(self, index: int) -> int:
+        """The highest value that falls into the bucket with the given index.
+        """
+        if index < 1 << self.precision:
+            return index
+        half = 1 << (self.precision - 1)
+        magnitude = index // half - 1
+        sub = index - magnitude * half
+        return ((sub + 1) << magnitude) - 1
+
+    def record(self, value: int) -> None:
+        value = min(max(value, 0), self.highest)
+        self._buckets[self._index(value)] += 1
+        self.total += 1
+        if value > self.max:
+            self.max = value
+        # Welford's algorithm for the streaming mean and variance
+        delta = value - self._mean
+        self._mean += delta / self.total
+        self._squares += delta * (value - self._mean)
+
+    @property
+    def mean(self) -> float:
+        return self._mean
+
+    @property
+    def variance(self) -> float:
+        if not self.total:
+            return 0.0
+        return self._squares / self.total
+
+    def percentile(self, percent: float) -> int:
+        if not self.total:
+            return 0
+        threshold = max(math.ceil(self.total * percent / 100), 1)
+        seen = 0
+        for index, count in enumerate(self._buckets):
+            seen += count
+            if seen >= threshold:
+                return min(self._upper(index), self.max)
+        return self.max
+
+
+@attr.s(auto_attribs=True, kw_only=True)
+class RollingWindow:
+    """Latency stats for the last `size` seconds.
+
+    Samples are aggregated into a ring buffer of per-second slots.
+    Recording is O(1): running totals are updated on every sample,
+    and slots falling out of the window are subtracted from them.
+    """
+    size: int = 60
+
+    count: int = 0
+    errors: int = 0
+    _sum: float = 0.0
+    _squares: float = 0.0
+    _second: int = -1
+    _counts: array = attr.ib(init=False)
+    _errors: array = attr.ib(init=False)
+    _sums: array = attr.ib(init=False)
+    _squares_sums: array = attr.ib(init=False)
+    _maxes: array = attr.ib(init=False)
+
+    def __attrs_post_init__(self) -> None:
+        self._counts = array('Q', bytes(8 * self.size))
+        self._errors = array('Q', bytes(8 * self.size))
+        self._sums = array('d', bytes(8 * self.size))
+        self._squares_sums = array('d', bytes(8 * self.size))
+        self._maxes = array('Q', bytes(8 * self.size))
+
+    def advance(self, now: float) -> None:
+        """Expire slots that are older than `size` seconds at the `now` moment.
+        """
+        second = int(now)
+        if self._second < 0:
+            self._second = second
+            return
+        if second <= self._second:
+            return
+        for step in range(1, min(second - self._second, self.size) + 1):
+            index = (self._second + step) % self.size
+            self.count -= self._counts[index]
+            self.errors -= self._errors[index]
+            self._sum -= self._sums[index]
+            self._squares -= self._squares_sums[index]
+            self._counts[index] = 0
+            self._errors[index] = 0
+            self._sums[index] = 0.0
+            self._squares_sums[index] = 0.0
+            self._maxes[index] = 0
+        self._second = second
+
+    def record(self, value: int, now: float) -> None:
+        self.advance(now)
+        index = self._second % self.size
+        self._counts[index] += 1
+        self._sums[index] += value
+        self._squares_sums[index] += value * value
+        if value > self._maxes[index]:
+            self._maxes[index] = value
+        self.count += 1
+        self._sum += value
+        self._squares += value * value
+
+    def record_error(self, now: float) -> None:
+        self.advance(now)
+        self._errors[self._second % self.size] += 1
+        self.errors += 1
+
+    @property
+    def mean(self) -> float:
+        if not self.count:
+            return 0.0
+        return self._sum / self.count
+
+    @property
+    def stddev(self) -> float:
+        if not self.count:
+            return 0.0
+        variance = self._squares / self.count - self.mean ** 2
+        return math.sqrt(max(variance, 0.0))
+
+    @property
+    def max(self) -> int:
+        return max(self._maxes)
+
+
+@attr.s(auto_attribs=True, kw_only=True)
+class PrometheusExporter:
+    """Serve metrics in Prometheus text exposition format on `host:port/metrics`.
+
+    Metrics are rendered from the histograms and windows on every scrape,
+    so the measurement loop doesn't do any extra work for the exporter.
+    """
+    port: int
+    host: str = '127.0.0.1'
+    labels: Dict[str, str] = attr.Factory(dict)
+    histograms: Dict[str, LatencyHistogram] = attr.Factory(dict)
+    windows: Dict[str, RollingWindow] = attr.Factory(dict)
+    percentiles: Sequence[float] = (50, 90, 99, 99.9)
+
+    _server: Optional[ThreadingHTTPServer] = None
+
+    def _labels(self, **extra: str) -> str:
+        labels = dict(self.labels, **extra)
+        pairs = []
+        for key, value in labels.items():
+            value = value.replace('\\', '\\\\').replace('"', '\\"')
+            pairs.append(f'{key}="{value}"')
+        return '{' + ','.join(pairs) + '}'
+
+    def render(self) -> str:
+        lines = []
+        name = 'healthcheck_latency_microseconds'
+        lines.append(f'# TYPE {name} summary')
+        for kind, histogram in self.histograms.items():
+            for percent in self.percentiles:
+                labels = self._labels(kind=kind, quantile=f'{percent / 100:g}')
+                # quantiles of an empty summary are NaN by Prometheus convention
+                value = histogram.percentile(percent) if histogram.total else 'NaN'
+                lines.append(f'{name}{labels} {value}')
+            labels = self._labels(kind=kind)
+            lines.append(f'{name}_sum{labels} {histogram.mean * histogram.total}')
+            lines.append(f'{name}_count{labels} {histogram.total}')
+
+        gauges = dict(
+            count=lambda window: window.count,
+            errors=lambda window: window.errors,
+            mean_microseconds=lambda window: window.mean,
+            max_microseconds=lambda window: window.max,
+        )
+        for suffix, getter in gauges.items():
+            if not self.windows:
+                break
+            name = 'healthcheck_window_' + suffix
+            lines.append(f'# TYPE {name} gauge')
+            for window_name, window in self.windows.items():
+                labels = self._labels(window=window_name)
+                lines.append(f'{name}{labels} {getter(window)}')
+        return '\n'.join(lines) + '\n'
+
+    def start(self) -> None:
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logging.getLogger(__name__).debug(format, *args)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+
 
 @attr.s(auto_attribs=True, kw_only=True)
 class SpeedTestCommand(BaseCommand):
     url: str = 'http://httpbin.org/status/200'
     count: int = 2
+    concurrency: int = 1
+
+    percentiles: Sequence[float] = (50, 90, 99, 99.9)
+
+    # connection pool settings, `pool_size` is `concurrency` by default
+    pool_size: Optional[int] = None
+    keep_alive: bool = True
+    http2: bool = False
+    # serve Prometheus metrics on this port while measuring, 0 to disable
+    export_port: int = 0
 
     _bad_response: httpx.Response = None
+    _duration: float = 0.0
+    _histogram: LatencyHistogram = attr.Factory(LatencyHistogram)
+    # requests that had to open a new connection
+    _cold: LatencyHistogram = attr.Factory(LatencyHistogram)
+    # requests that reused a connection from the pool
+    _warm: LatencyHistogram = attr.Factory(LatencyHistogram)
+    # time spent in every request phase, see PHASES
+    _phases: Dict[str, LatencyHistogram] = attr.Factory(
+        lambda: {phase: LatencyHistogram() for phase in PHASES},
+    )
 
     @cached_property
-    def deltas(self) -> Tuple[timedelta, ...]:
-        deltas = []
-        for _ in range(2):
-            response = httpx.get(self.url)
-            if response.status_code != 200:
-                self._bad_response = response
-                break
-            deltas.append(response.elapsed.microseconds)
-        return deltas
+    def histogram(self) -> LatencyHistogram:
+        with self._exporting():
+            asyncio.run(self._run())
+        return self._histogram
+
+    def _exporter(self) -> PrometheusExporter:
+        return PrometheusExporter(
+            port=self.export_port,
+            labels=dict(url=self.url),
+            histograms=dict(
+                all=self._histogram,
+                cold=self._cold,
+                warm=self._warm,
+                **{'phase_' + phase: h for phase, h in self._phases.items()},
+            ),
+            percentiles=self.percentiles,
+        )
+
+    @contextmanager
+    def _exporting(self) -> Iterator[None]:
+        if not self.export_port:
+            yield
+            return
+        exporter = self._exporter()
+        exporter.start()
+        try:
+            yield
+        finally:
+            exporter.stop()
+
+    def _client(self) -> httpx.AsyncClient:
+        concurrency = max(self.concurrency, 1)
+        size = self.pool_size or concurrency
+        if size < concurrency:
+            # `response.elapsed` includes waiting for a free connection in the pool
+            logging.getLogger(__name__).warning(
+                'pool size %d is less than concurrency %d, latency includes waiting for the pool',
+                size, concurrency,
+            )
+        limits = httpx.Limits(
+            max_connections=size,
+            max_keepalive_connections=size if self.keep_alive else 0,
+        )
+        return httpx.AsyncClient(limits=limits, http2=self.http2)
+
+    async def _run(self) -> None:
+        # all workers pull jobs from the same iterator,
+        # so exactly `count` requests are sent in total.
+        jobs = iter(range(self.count))
+        async with self._client() as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                self._worker(client=client, jobs=jobs)
+                for _ in range(max(self.concurrency, 1))
+            ))
+            self._duration = time.perf_counter() - started
+
+    async def _worker(self, client: httpx.AsyncClient, jobs: Iterator[int]) -> None:
+        for _ in jobs:
+            if self._bad_response is not None:
+                return
+            await self._request(client)
+
+    async def _request(
+        self, client: httpx.AsyncClient, intended: Optional[float] = None,
+    ) -> Optional[int]:
+        """Send a request, record and return its latency.
+
+        If `intended` send time (`time.perf_counter` value) is passed,
+        latency is measured from it rather than from the actual send time.
+        Returns None if the response is bad.
+        """
+        moments: Dict[str, float] = dict()
+
+        async def trace(event: str, info: dict) -> None:
+            if event.startswith('http'):
+                event = event.split('.', maxsplit=1)[1]
+            moments[event] = time.perf_counter()
+
+        response = await client.get(self.url, extensions={'trace': trace})
+        if response.status_code != 200:
+            self._bad_response = response
+            return None
+        if intended is None:
+            delta = int(response.elapsed.total_seconds() * 1e6)
+        else:
+            delta = int((time.perf_counter() - intended) * 1e6)
+        self._histogram.record(delta)
+        for phase, (start, end) in PHASES.items():
+            if start in moments and end in moments:
+                self._phases[phase].record(int((moments[end] - moments[start]) * 1e6))
+        if PHASES['connect'][1] in moments:
+            self._cold.record(delta)
+        else:
+            self._warm.record(delta)
+        return delta
 
     @cached_property
     def failure(self) -> str:
+        # make sure requests are sent before checking for a bad response
+        self.histogram
         if self._bad_response is None:
             return ''
+        return self._format_failure(self._bad_response)
+
+    @staticmethod
+    def _format_failure(response: httpx.Response) -> str:
         return '{code} {reason}'.format(
-            code=self._bad_response.status_code,
-            reason=self._bad_response.reason_phrase,
+            code=response.status_code,
+            reason=response.reason_phrase,
         )
 
     @cached_property
     def mean(self) -> float:
-        return sum(self.deltas) / len(self.deltas)
+        return self.histogram.mean
 
     @cached_property
-    def deviations(self) -> Tuple[float, ...]:
-        return tuple(self.mean - d for d in self.deltas)
+    def rps(self) -> float:
+        if not self._duration:
+            return 0.0
+        return self.histogram.total / self._duration
 
     @cached_property
     def variance(self) -> float:
-        return sum(d ** 2 for d in self.deviations) / len(self.deviations)
+        return self.histogram.variance
 
     @cached_property
     def stddev(self) -> float:
@@ -63,22 +452,274 @@ class SpeedTestCommand(BaseCommand):
 
     def _do(self) -> int:
         if self.failure:
-            self._print(self.failure)
+            self._emit(dict(failure=self.failure), text=self.failure)
             return 1
 
-        self._print('mean:', self.mean)
-        self._print('std dev:', self.stddev)
+        self._emit(self._metrics())
+        return 0
+
+    def _metrics(self) -> Dict[str, Any]:
+        metrics: Dict[str, Any] = dict(
+            requests=self.histogram.total,
+            mean=self.mean,
+            stddev=self.stddev,
+        )
+        for percent in self.percentiles:
+            metrics[f'p{percent}'] = self.histogram.percentile(percent)
+        metrics['max'] = self.histogram.max
+        metrics['rps'] = round(self.rps, 2)
+        for name, histogram in (('cold', self._cold), ('warm', self._warm)):
+            if not histogram.total:
+                continue
+            metrics[f'{name}_requests'] = histogram.total
+            metrics[f'{name}_mean'] = histogram.mean
+            metrics[f'{name}_p99'] = histogram.percentile(99)
+        for phase, histogram in self._phases.items():
+            if not histogram.total:
+                continue
+            metrics[f'{phase}_mean'] = histogram.mean
+            metrics[f'{phase}_p99'] = histogram.percentile(99)
+        return metrics
+
+    def __call__(self) -> NoReturn:
+        sys.exit(self._do())
+
+
+@attr.s(auto_attribs=True, kw_only=True)
+class LoadTestCommand(SpeedTestCommand):
+    """Open-loop load test: send `rate` requests per second on a fixed timetable.
+
+    Unlike `speed`, a slow response doesn't delay the next request,
+    and latency is measured from the time the request was supposed to be sent,
+    so queueing on the server side isn't hidden (no coordinated omission).
+    """
+    rate: float = 10.0
+    count: int = 100
+    # max requests in flight
+    concurrency: int = 1000
+    # how long before the intended send time to stop sleeping and start spinning
+    spin: float = 0.002
+
+    # number of failed requests by exception name or by status code (`status_503`)
+    _errors: Dict[str, int] = attr.Factory(dict)
+
+    async def _run(self) -> None:
+        limit = asyncio.Semaphore(max(self.concurrency, 1))
+        pending: Set[asyncio.Task] = set()
+        async with self._client() as client:
+            started = time.perf_counter()
+            for i in range(self.count):
+                intended = started + i / self.rate
+                await self._sleep_until(intended)
+                task = asyncio.ensure_future(self._scheduled(
+                    client=client, intended=intended, limit=limit,
+                ))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+            self._duration = time.perf_counter() - started
+
+    async def _sleep_until(self, moment: float) -> None:
+        # `asyncio.sleep` can oversleep for a millisecond or so,
+        # so sleep only until shortly before the moment and then yield to the loop.
+        delay = moment - time.perf_counter() - self.spin
+        if delay > 0:
+            await asyncio.sleep(delay)
+        while time.perf_counter() < moment:
+            await asyncio.sleep(0)
+
+    async def _scheduled(
+        self, client: httpx.AsyncClient, intended: float, limit: asyncio.Semaphore,
+    ) -> None:
+        # timeouts, refused connections, and 5xx responses are expected under overload,
+        # so they're counted and the timetable goes on.
+        async with limit:
+            try:
+                await self._request(client, intended=intended)
+            except httpx.HTTPError as exc:
+                name = type(exc).__name__
+            else:
+                if self._bad_response is None:
+                    return
+                name = f'status_{self._bad_response.status_code}'
+                self._bad_response = None
+        self._errors[name] = self._errors.get(name, 0) + 1
+
+    def _metrics(self) -> Dict[str, Any]:
+        metrics = dict(target_rps=self.rate, **super()._metrics())
+        metrics['errors'] = sum(self._errors.values())
+        for name, count in sorted(self._errors.items()):
+            metrics[f'errors_{name}'] = count
+        return metrics
+
+
+@attr.s(auto_attribs=True, kw_only=True)
+class SweepCommand(BaseCommand):
+    """Probe many URLs concurrently and print every result as soon as it's ready.
+
+    Targets are read one URL per line from the `targets` file
+    or from stdin if it is `-`. Empty lines and lines starting with `#` are skipped.
+    """
+    targets: str = '-'
+    timeout: float = 5.0
+    concurrency: int = 100
+    # max concurrent requests to the same host
+    per_host: int = 4
+
+    _failed: int = 0
+
+    def _read_targets(self) -> List[str]:
+        if self.targets == '-':
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(self.targets) as stream:
+                lines = stream.read().splitlines()
+        lines = [line.strip() for line in lines]
+        return [line for line in lines if line and not line.startswith('#')]
+
+    async def _run(self, urls: List[str]) -> None:
+        limit = asyncio.Semaphore(max(self.concurrency, 1))
+        host_limits: Dict[str, asyncio.Semaphore] = dict()
+        # don't count waiting for a free connection as a timeout
+        timeout = httpx.Timeout(self.timeout, pool=None)
+        limits = httpx.Limits(max_connections=self.concurrency)
+        async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+            await asyncio.gather(*(
+                self._probe(client=client, url=url, limit=limit, host_limits=host_limits)
+                for url in urls
+            ))
+
+    async def _probe(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        limit: asyncio.Semaphore,
+        host_limits: Dict[str, asyncio.Semaphore],
+    ) -> None:
+        try:
+            host = httpx.URL(url).host
+        except httpx.InvalidURL:
+            host = ''
+        host_limit = host_limits.setdefault(host, asyncio.Semaphore(max(self.per_host, 1)))
+        async with limit, host_limit:
+            started = time.perf_counter()
+            try:
+                response = await client.get(url)
+            except (httpx.HTTPError, httpx.InvalidURL) as exc:
+                status = type(exc).__name__
+                ok = False
+            else:
+                status = f'{response.status_code} {response.reason_phrase}'
+                ok = response.status_code < 400
+            latency = (time.perf_counter() - started) * 1000
+        if not ok:
+            self._failed += 1
+        self._emit(
+            dict(url=url, ok=ok, status=status, latency_ms=round(latency, 1)),
+            text=f"{url} {'OK' if ok else 'FAIL'} {status} {latency:.0f}ms",
+        )
+
+    def _do(self) -> int:
+        urls = self._read_targets()
+        asyncio.run(self._run(urls))
+        if self._failed:
+            self._emit(
+                dict(failed=self._failed, total=len(urls)),
+                text=f'failed: {self._failed}/{len(urls)}',
+            )
+            return 1
+        return 0
 
     def __call__(self) -> NoReturn:
         sys.exit(self._do())
 
 
+@attr.s(auto_attribs=True, kw_only=True)
+class WatchCommand(SpeedTestCommand):
+    """Send a request every `interval` seconds until interrupted.
+
+    Every `report` seconds prints stats for each of the sliding `windows`
+    (in seconds, the last 1, 5, and 15 minutes by default).
+    """
+    interval: float = 1.0
+    report: float = 10.0
+    windows: Sequence[int] = (60, 300, 900)
+    # stop after this many requests, 0 means never
+    count: int = 0
+
+    _rolling: List[RollingWindow] = attr.Factory(
+        lambda self: [RollingWindow(size=size) for size in self.windows],
+        takes_self=True,
+    )
+
+    def _exporter(self) -> PrometheusExporter:
+        exporter = super()._exporter()
+        exporter.windows = {f'{size}s': w for size, w in zip(self.windows, self._rolling)}
+        return exporter
+
+    async def _run(self) -> None:
+        async with self._client() as client:
+            started = time.perf_counter()
+            next_report = started + self.report
+            sent = 0
+            while not self.count or sent < self.count:
+                sent += 1
+                tick = time.perf_counter()
+                try:
+                    delta = await self._request(client)
+                except httpx.HTTPError as exc:
+                    self._bad_response = None
+                    self._emit(dict(error=type(exc).__name__))
+                    delta = None
+                now = time.perf_counter()
+                if delta is None:
+                    if self._bad_response is not None:
+                        self._emit(dict(error=self._format_failure(self._bad_response)))
+                        self._bad_response = None
+                    for window in self._rolling:
+                        window.record_error(now)
+                else:
+                    for window in self._rolling:
+                        window.record(delta, now)
+                if now >= next_report:
+                    self._report(now)
+                    next_report += self.report
+                await asyncio.sleep(max(tick + self.interval - now, 0))
+            self._duration = time.perf_counter() - started
+
+    def _report(self, now: float) -> None:
+        for size, window in zip(self.windows, self._rolling):
+            window.advance(now)
+            record = dict(
+                window=size,
+                count=window.count,
+                errors=window.errors,
+                mean=round(window.mean),
+                stddev=round(window.stddev),
+                max=window.max,
+            )
+            text = ' '.join(f'{k}={v}' for k, v in record.items() if k != 'window')
+            self._emit(record, text=f'{size}s: {text}')
+
+    def _do(self) -> int:
+        try:
+            with self._exporting():
+                asyncio.run(self._run())
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+
 @attr.s(auto_attribs=True)
 class Commands:
     log_level: str = 'WARNING'
 
     _registry = dict(
         speed=SpeedTestCommand,
+        load=LoadTestCommand,
+        sweep=SweepCommand,
+        watch=WatchCommand,
     )
 
     def __call__(self):
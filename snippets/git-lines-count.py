@@ -3,31 +3,86 @@ A script that calculates how many lines are changed in each git commit.
 
 It is supposed to be copy-pasted into a Jupyter notebook for further experiments.
 Don't try to use it from console, it won't show anything.
+
+Stats of analysed commits are cached in `.git/git-lines-count.parquet` (requires pyarrow),
+so reruns analyse only new merge commits.
 """
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import os
 import plotnine as gg
 import pandas
 import subprocess
 
+# stats for already analysed commits, so reruns analyse only new merges.
+# It's stored in the git dir (shared by all worktrees) to keep the working tree clean.
+GIT_DIR = subprocess.run(
+    ['git', 'rev-parse', '--git-common-dir'], stdout=subprocess.PIPE, check=True,
+).stdout.decode().strip()
+CACHE_PATH = Path(GIT_DIR) / 'git-lines-count.parquet'
+WORKERS = os.cpu_count() or 1
+COLUMNS = ['commit', 'insertions', 'deletions']
+
+
+def parse_shortstat(lines) -> list:
+    """Parse output of `git log --shortstat --format='commit %H'`.
+    """
+    sizes = []
+    for line in lines:
+        words = line.split()
+        if not words:
+            continue
+        if words[0] == 'commit':
+            sizes.append({'commit': words[1], 'insertions': 0, 'deletions': 0})
+            continue
+        for i, word in enumerate(words):
+            if 'insertion' in word:
+                sizes[-1]['insertions'] = int(words[i-1])
+            if 'deletion' in word:
+                sizes[-1]['deletions'] = int(words[i-1])
+    return sizes
+
+
+def get_sizes(commits: list) -> list:
+    """Compare every given merge commit with its first parent in one `git log` run.
+    """
+    cmd = [
+        'git', 'log', '--no-walk=unsorted', '--stdin', '--diff-merges=first-parent',
+        '--shortstat', '--format=commit %H',
+    ]
+    proc = subprocess.Popen(
+        cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True,
+    )
+    # git reads all revisions from stdin before producing any output
+    proc.stdin.write('\n'.join(commits) + '\n')
+    proc.stdin.close()
+    sizes = parse_shortstat(proc.stdout)
+    proc.wait()
+    return sizes
+
+
 # collect all merge commits
 res = subprocess.run(['git', 'rev-list', '--merges', 'HEAD'], stdout=subprocess.PIPE)
 commits = res.stdout.decode().split()
 
-# collect inerted and deleted lines count
-sizes = []
-for sha1, sha2 in zip(commits, commits[1:]):
-    res = subprocess.run(['git', 'diff', '--shortstat', sha1, sha2], stdout=subprocess.PIPE)
-    words = res.stdout.decode().split()
-    plus = 0
-    minus = 0
-    for i, word in enumerate(words):
-        if 'insertion' in word:
-            plus = int(words[i-1])
-        if 'deletion' in word:
-            minus = int(words[i-1])
-    sizes.append({'insertions': plus, 'deletions': minus})
-
-
-df = pandas.DataFrame(sizes)
+# collect inserted and deleted lines count for new merge commits.
+# Commits are split into shards, each shard is analysed by a separate `git log` process.
+cache = pandas.DataFrame(columns=COLUMNS)
+if CACHE_PATH.exists():
+    cache = pandas.read_parquet(CACHE_PATH)
+known = set(cache.commit)
+new_commits = [sha for sha in commits if sha not in known]
+if new_commits:
+    shards = [new_commits[i::WORKERS] for i in range(WORKERS)]
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        results = executor.map(get_sizes, [shard for shard in shards if shard])
+    sizes = [size for shard_sizes in results for size in shard_sizes]
+    cache = pandas.concat([cache, pandas.DataFrame(sizes, columns=COLUMNS)], ignore_index=True)
+    cache = cache.astype({'insertions': 'int64', 'deletions': 'int64'})
+    cache.to_parquet(CACHE_PATH, index=False)
+
+
+df = cache.set_index('commit').reindex(commits).reset_index()
 df['newlines'] = df.insertions - df.deletions
 df.describe()
 
@@ -6,10 +6,14 @@ doesn't support `include` and `extend`.
 
 Provided features:
 
-    1. Config-level `include` support
-    1. Job-level `extends` support
+    1. Config-level `include` support, including nested includes
+    1. Job-level `extends` support, including chains and lists of `extends`
+    1. `!reference` tags support
     1. Execute dependencies before running a job. Uses `needs` field (!5132)
+    1. Run independent dependencies in parallel.
     1. Share artifacts between jobs.
+    1. Cache artifacts of successful jobs and skip jobs that didn't change.
+    1. Report time spent by every job and the critical path of the pipeline.
     1. Save artifacts from the job on the host machine.
 
 Examples:
@@ -17,6 +21,7 @@ Examples:
     sudo python3 scripts/run-job.py --exe $HOME/.local/bin/gitlab-runner --job flake8
     sudo python3 scripts/run-job.py --job build-packages --file GPG_KEY=/path/to/my/key.gpg
     sudo python3 scripts/run-job.py --job build-a-package --env PACKAGE_NAME=example
+    sudo python3 scripts/run-job.py --job deploy --jobs 4
 
 Should be run with `sudo` to use docker runner (depends on your local docker setup).
 
@@ -31,68 +36,225 @@ Options:
     --conf: path to Gitlab CI config
     --env: env vars to set before running job
     --file: files to create before running job
+    --jobs: how many jobs can run in parallel
+    --cache-dir: where to keep artifacts of successful jobs between runs
+    --no-cache: don't use the artifacts cache
+    --worktree: run from a temporary git worktree instead of editing the config in-place
+    --report: path to JSON file to save per-job stats into
+
+After the run, a table with stats for every job is printed:
+time waiting for a free worker after all needed jobs finished, wall time of the job,
+size and time of preparing input artifacts and of collecting output artifacts, exit code.
+Jobs on the critical path (the chain of `needs` with the longest total wall time)
+are marked with `*`, optimize them first to make the pipeline faster.
+
+Every job gets its own artifacts directory. Before running a job,
+artifacts of all jobs it (transitively) needs are merged into its working directory.
+When running jobs in parallel, output lines of each job are prefixed by the job name.
+
+Artifacts of every successful job are stored in the cache under a key
+made of the job definition, env vars, passed files, the committed git tree,
+and keys of the jobs it needs. If the key is already in the cache, the job is skipped,
+and its cached artifacts are hard-linked into the jobs that need it.
+The requested `--job` itself is never skipped, only the jobs it needs.
+Nothing is ever evicted from the cache, so remove `--cache-dir` when it grows too big.
 
 Keep in mind that gitlab-runner runs a job only on commited changes.
 Use `git commit --amend` to temporary commit changes you want to test.
 
 When runs a job, edits in-place `.gitlab-ci.yml`
 because `gitlab-runner` doesn't support specifying a custom path to the config.
+So, only one run at a time is possible in one checkout.
+Pass `--worktree` to leave the checkout untouched instead: the resolved config is committed
+into a temporary detached `git worktree` of HEAD, and jobs are run from there.
 """
 
+import hashlib
+import json
+import os
 import shutil
 import subprocess
+import time
 from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
 from pathlib import Path
 from tempfile import TemporaryDirectory
+from typing import Iterator, Optional, Tuple
 
 import yaml
 
 
 CACHE_DIR = '/tmp/gitlab-cache'
+ARTIFACTS_DIR = '/tmp/gitlab-artifacts'
 YELLOW = '\033[1;33m'
 RESET = '\033[0m'
 
 
-def process_root_conf(root_conf: dict) -> None:
-    # include subconfigs
-    for include in root_conf.get('include', []):
-        with open(include['local']) as stream:
-            included_conf = yaml.load(stream=stream, Loader=yaml.SafeLoader)
-        root_conf.update(included_conf)
-
-    # evaluate `extends`
-    for name, job in root_conf.items():
-        if not isinstance(job, dict):
-            continue
-        if 'extends' not in job:
-            continue
-        base_job = root_conf[job['extends']]
-        # merge `variables` section
-        env_vars = base_job.get('variables', {}).copy()
-        env_vars.update(job.get('variables', {}))
-        # merge job configs
-        new_job = base_job.copy()
-        new_job.update(job)
-        # set merged `variables`
-        if env_vars:
-            new_job['variables'] = env_vars
-        root_conf[name] = new_job
+@dataclass
+class JobStats:
+    job: str
+    status: str = 'pending'
+    exit_code: Optional[int] = None
+    queue_wait: float = 0.0
+    wall_time: float = 0.0
+    input_bytes: int = 0
+    input_time: float = 0.0
+    output_bytes: int = 0
+    output_time: float = 0.0
+    critical: bool = False
+
+
+class Reference(list):
+    """Value of `!reference` tag: path to a value in another job.
+    """
+
+
+class Loader(yaml.SafeLoader):
+    pass
+
+
+Loader.add_constructor(
+    '!reference',
+    lambda loader, node: Reference(loader.construct_sequence(node)),
+)
+
+
+def deep_merge(base: dict, override: dict) -> dict:
+    """Merge dicts recursively, values from `override` win. Lists aren't merged.
+
+    Neither of the dicts is modified.
+    """
+    result = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(result.get(key), dict):
+            value = deep_merge(result[key], value)
+        result[key] = value
+    return result
+
+
+class ConfResolver:
+    """Resolve `include`, `extends`, and `!reference` in a Gitlab CI config.
+
+    Every file is parsed and every job is resolved only once.
+    Only `local` includes are supported.
+    """
+
+    def __init__(self, path: str) -> None:
+        self._files = dict()
+        self._jobs = dict()
+        self._resolving = []
+        self.raw = self._load(path, stack=())
+
+    def _parse(self, path: str) -> dict:
+        if path not in self._files:
+            with open(path) as stream:
+                self._files[path] = yaml.load(stream=stream, Loader=Loader) or {}
+        return self._files[path]
+
+    def _get_includes(self, conf: dict) -> list:
+        includes = conf.get('include', [])
+        if isinstance(includes, (str, dict)):
+            includes = [includes]
+        paths = []
+        for include in includes:
+            if isinstance(include, dict):
+                if 'local' not in include:
+                    print(f'{YELLOW}# Skipped unsupported include: {include}{RESET}')
+                    continue
+                include = include['local']
+            if include.startswith(('http://', 'https://')):
+                print(f'{YELLOW}# Skipped unsupported include: {include}{RESET}')
+                continue
+            # local paths are relative to the project root
+            include = include.lstrip('/')
+            if '*' in include:
+                paths.extend(sorted(str(path) for path in Path().glob(include)))
+            else:
+                paths.append(include)
+        return paths
+
+    def _load(self, path: str, stack: tuple) -> dict:
+        """Read the config and deep merge into it all included configs.
+        """
+        if path in stack:
+            raise ValueError(f'circular include: {path}')
+        conf = self._parse(path)
+        result = dict()
+        for include in self._get_includes(conf):
+            result = deep_merge(result, self._load(include, stack=stack + (path, )))
+        own = {key: value for key, value in conf.items() if key != 'include'}
+        return deep_merge(result, own)
+
+    def resolve_job(self, name: str) -> dict:
+        """Get job config with all `extends` applied.
+        """
+        if name in self._jobs:
+            return self._jobs[name]
+        if name in self._resolving:
+            raise ValueError(f'circular extends: {name}')
+        self._resolving.append(name)
+        job = self.raw[name]
+        bases = job.get('extends', [])
+        if isinstance(bases, str):
+            bases = [bases]
+        result = dict()
+        for base in bases:
+            result = deep_merge(result, self.resolve_job(base))
+        own = {key: value for key, value in job.items() if key != 'extends'}
+        result = deep_merge(result, own)
+        self._resolving.pop()
+        self._jobs[name] = result
+        return result
+
+    def _dereference(self, value, depth: int = 0):
+        if depth > 10:
+            raise ValueError('too deep nesting of !reference tags')
+        if isinstance(value, Reference):
+            target = self.resolve_job(value[0])
+            for key in value[1:]:
+                target = target[key]
+            return self._dereference(target, depth=depth + 1)
+        if isinstance(value, dict):
+            return {k: self._dereference(v, depth=depth) for k, v in value.items()}
+        if isinstance(value, list):
+            result = []
+            for item in value:
+                resolved = self._dereference(item, depth=depth)
+                # referenced lists are inlined, like Gitlab does for scripts
+                if isinstance(item, Reference) and isinstance(resolved, list):
+                    result.extend(resolved)
+                else:
+                    result.append(resolved)
+            return result
+        return value
+
+    def resolve(self) -> dict:
+        result = dict()
+        for name, value in self.raw.items():
+            if isinstance(value, dict):
+                value = self.resolve_job(name)
+            result[name] = self._dereference(value)
+        return result
 
 
 def make_post_script(root_conf: dict, job: str) -> str:
     post_script = ['cd $CI_PROJECT_DIR']
     for artifact in root_conf[job].get('artifacts', {}).get('paths', []):
-        post_script.append(f'cp -r {artifact} {CACHE_DIR}/')
+        post_script.append(f'cp -r {artifact} {ARTIFACTS_DIR}/')
     return '\n'.join(post_script)
 
 
 def run_job(
-    exe: str, job: str, cache_path: str, root_conf: dict, env_vars: dict,
+    exe: str, job: str, job_path: Path, root_conf: dict, env_vars: dict,
+    prefix: bool = False, workdir: Optional[str] = None,
 ) -> int:
     post_script = make_post_script(job=job, root_conf=root_conf)
     cmd = [exe, '--log-level=debug', 'exec', 'docker']
-    cmd.extend(['--docker-cache-dir', cache_path])
-    cmd.extend(['--docker-volumes', f'{cache_path}:{CACHE_DIR}'])
+    cmd.extend(['--docker-cache-dir', str(job_path / 'docker-cache')])
+    cmd.extend(['--docker-volumes', f'{job_path / "input"}:{CACHE_DIR}'])
+    cmd.extend(['--docker-volumes', f'{job_path / "artifacts"}:{ARTIFACTS_DIR}'])
     # copy from cache artifacts created on previous stages
     cmd.extend(['--pre-build-script', f'cp -r {CACHE_DIR}/* ./ || true'])
     # save created artifacts into cache
@@ -100,34 +262,342 @@ def run_job(
     for k, v in env_vars.items():
         cmd.extend(['--env', f'{k}={v}'])
     cmd.append(job)
-    return subprocess.call(cmd)
-
-
-def save_artifacts(cache_path: str) -> None:
-    for artifact in Path(cache_path).iterdir():
+    if not prefix:
+        return subprocess.call(cmd, cwd=workdir)
+    # prefix output lines by the job name, so outputs of parallel jobs can be told apart
+    proc = subprocess.Popen(
+        cmd, cwd=workdir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        universal_newlines=True, errors='replace',
+    )
+    for line in proc.stdout:
+        print(f'{YELLOW}{job} |{RESET} {line}', end='', flush=True)
+    return proc.wait()
+
+
+def run_job_timed(**kwargs) -> Tuple[int, float, float]:
+    """Run the job and return its exit code, start time, and finish time.
+    """
+    started = time.monotonic()
+    retcode = run_job(**kwargs)
+    return retcode, started, time.monotonic()
+
+
+def get_size(path: Path) -> int:
+    size = 0
+    for root, _, files in os.walk(str(path)):
+        for name in files:
+            size += os.lstat(os.path.join(root, name)).st_size
+    return size
+
+
+def link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def prepare_job(job: str, dep_artifacts: list, cache_path: str, files_path: Path) -> Path:
+    """Create the job directory and merge into its input the given artifacts.
+
+    Artifacts are hard-linked when possible, `gitlab-runner` copies them
+    into the job working directory anyway.
+    """
+    job_path = Path(cache_path) / 'jobs' / job
+    input_path = job_path / 'input'
+    (job_path / 'artifacts').mkdir(parents=True)
+    (job_path / 'docker-cache').mkdir()
+    shutil.copytree(str(files_path), str(input_path))
+    for artifacts_path in dep_artifacts:
+        shutil.copytree(
+            str(artifacts_path), str(input_path),
+            copy_function=link_or_copy, dirs_exist_ok=True,
+        )
+    return job_path
+
+
+def hash_file(path: Path) -> str:
+    hasher = hashlib.sha256()
+    with path.open('rb') as stream:
+        for chunk in iter(lambda: stream.read(1 << 20), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def get_git_tree() -> str:
+    """Hash of the committed files. gitlab-runner runs jobs only on committed changes.
+    """
+    cmd = ['git', 'rev-parse', 'HEAD^{tree}']
+    return subprocess.check_output(cmd, universal_newlines=True).strip()
+
+
+def get_cache_key(
+    job: str, root_conf: dict, env_vars: dict, files_path: Path, tree: str, dep_keys: list,
+) -> str:
+    payload = dict(
+        job=job,
+        conf=root_conf[job],
+        env=env_vars,
+        files={path.name: hash_file(path) for path in files_path.iterdir()},
+        tree=tree,
+        deps=dep_keys,
+    )
+    content = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def run_pipeline(
+    exe: str, jobs: list, cache_path: str, root_conf: dict, env_vars: dict,
+    files_path: Path, workers: int = 1, cache_root: Optional[Path] = None,
+    workdir: Optional[str] = None,
+) -> Tuple[int, dict, dict]:
+    """Run jobs, starting every job as soon as all jobs it needs are finished.
+
+    Up to `workers` jobs run at the same time.
+    If `cache_root` is passed, jobs with artifacts in the cache are skipped
+    (except the last job, the one requested by the user),
+    and artifacts of successful jobs are moved into the cache.
+    Returns the exit code of the first failed job (or 0),
+    paths to artifacts of every successful job, and `JobStats` of every job.
+    """
+    pending = list(jobs)
+    done = set()
+    running = dict()
+    retcode = 0
+    # where artifacts of finished jobs are
+    artifacts = dict()
+    cache_keys = dict()
+    stats = {job: JobStats(job=job) for job in jobs}
+    pipeline_started = time.monotonic()
+    finished_at = dict()
+    tree = get_git_tree() if cache_root is not None else ''
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        while pending or running:
+            for job in list(pending):
+                if retcode or len(running) >= workers:
+                    break
+                if not all(dep in done for dep in get_needs(root_conf[job])):
+                    continue
+                pending.remove(job)
+                job_stats = stats[job]
+                ready_at = max(
+                    (finished_at[dep] for dep in get_needs(root_conf[job])),
+                    default=pipeline_started,
+                )
+                deps = get_deps(job=job, root_conf=root_conf)
+                if cache_root is not None:
+                    cache_keys[job] = get_cache_key(
+                        job=job,
+                        root_conf=root_conf,
+                        env_vars=env_vars,
+                        files_path=files_path,
+                        tree=tree,
+                        dep_keys=[cache_keys[dep] for dep in deps],
+                    )
+                    cached = cache_root / 'artifacts' / cache_keys[job]
+                    if cached.is_dir() and job != jobs[-1]:
+                        print(f'{YELLOW}# Cached {job}{RESET}')
+                        artifacts[job] = cached
+                        done.add(job)
+                        finished_at[job] = time.monotonic()
+                        job_stats.status = 'cached'
+                        job_stats.output_bytes = get_size(cached)
+                        continue
+                prepare_started = time.monotonic()
+                job_path = prepare_job(
+                    job=job,
+                    dep_artifacts=[artifacts[dep] for dep in deps],
+                    cache_path=cache_path,
+                    files_path=files_path,
+                )
+                job_stats.input_time = time.monotonic() - prepare_started
+                job_stats.input_bytes = get_size(job_path / 'input')
+                job_stats.status = 'running'
+                print(YELLOW, '-' * 80, RESET)
+                print(f'{YELLOW}# Running {job}{RESET}')
+                future = executor.submit(
+                    run_job_timed,
+                    exe=exe,
+                    job=job,
+                    job_path=job_path,
+                    root_conf=root_conf,
+                    env_vars=env_vars,
+                    prefix=workers > 1,
+                    workdir=workdir,
+                )
+                running[future] = (job, ready_at)
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job, ready_at = running.pop(future)
+                job_retcode, started, finished_at[job] = future.result()
+                job_stats = stats[job]
+                job_stats.exit_code = job_retcode
+                job_stats.queue_wait = max(started - ready_at, 0.0)
+                job_stats.wall_time = finished_at[job] - started
+                if job_retcode:
+                    print(f'{YELLOW}# Failed {job} with exit code {job_retcode}{RESET}')
+                    job_stats.status = 'failed'
+                    retcode = retcode or job_retcode
+                    continue
+                job_stats.status = 'ok'
+                done.add(job)
+                save_started = time.monotonic()
+                artifacts[job] = Path(cache_path) / 'jobs' / job / 'artifacts'
+                job_stats.output_bytes = get_size(artifacts[job])
+                if cache_root is not None:
+                    artifacts[job] = save_to_cache(artifacts[job], cache_root / 'artifacts' / cache_keys[job])
+                job_stats.output_time = time.monotonic() - save_started
+    return retcode, artifacts, stats
+
+
+def get_critical_path(jobs: list, root_conf: dict, stats: dict) -> list:
+    """The chain of `needs` with the longest total wall time.
+    """
+    total = dict()
+    prev = dict()
+    # jobs are in order of execution, so all needs of a job are visited before it
+    for job in jobs:
+        slowest = None
+        for dep in get_needs(root_conf[job]):
+            if dep in total and (slowest is None or total[dep] > total[slowest]):
+                slowest = dep
+        prev[job] = slowest
+        total[job] = stats[job].wall_time + (total[slowest] if slowest else 0.0)
+    job = max(total, key=total.get, default=None)
+    path = []
+    while job is not None:
+        path.append(job)
+        job = prev[job]
+    return path[::-1]
+
+
+def print_report(stats: dict) -> None:
+    print(YELLOW, '-' * 80, RESET)
+    header = f'  {"job":30} {"status":8} {"exit":>4} {"wait":>8} {"wall":>8} {"input":>16} {"output":>16}'
+    print(header)
+    for job_stats in stats.values():
+        mark = '*' if job_stats.critical else ' '
+        exit_code = '' if job_stats.exit_code is None else job_stats.exit_code
+        input_info = f'{job_stats.input_bytes / 2 ** 20:.1f}M/{job_stats.input_time:.1f}s'
+        output_info = f'{job_stats.output_bytes / 2 ** 20:.1f}M/{job_stats.output_time:.1f}s'
+        print(
+            f'{mark} {job_stats.job:30} {job_stats.status:8} {exit_code:>4} '
+            f'{job_stats.queue_wait:7.1f}s {job_stats.wall_time:7.1f}s '
+            f'{input_info:>16} {output_info:>16}',
+        )
+
+
+def save_to_cache(artifacts_path: Path, cached: Path) -> Path:
+    cached.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        # the cache is on the same file system, so it is an atomic rename
+        os.rename(str(artifacts_path), str(cached))
+    except OSError:
+        # another run already cached the same artifacts,
+        # keep using the fresh ones, the job could have been rerun on purpose
+        if not cached.is_dir():
+            raise
+        return artifacts_path
+    return cached
+
+
+def save_artifacts(artifacts_path: Path) -> None:
+    for artifact in artifacts_path.iterdir():
         # remove the old artifact
         dst = Path(artifact.name)
         if dst.is_dir():
             shutil.rmtree(str(dst))
         elif dst.is_file():
             dst.unlink()
-        # move or copy the new artifact
-        shutil.move(str(artifact), '.')
+        # copy the new artifact, don't hard-link to not let edits leak into the cache
+        if artifact.is_dir():
+            shutil.copytree(str(artifact), str(dst))
+        else:
+            shutil.copy2(str(artifact), str(dst))
+
+
+def get_needs(job_conf: dict) -> list:
+    result = []
+    for need in job_conf.get('needs', []):
+        if isinstance(need, dict):
+            # needs from other pipelines and projects can't be run locally
+            if 'job' not in need or 'pipeline' in need or 'project' in need:
+                continue
+            need = need['job']
+        result.append(need)
+    return result
 
 
 def get_deps(job: str, root_conf: dict) -> list:
-    job_conf = root_conf[job]
+    """All jobs the job needs, directly or transitively, in order of execution.
+
+    Every job is visited only once, so diamond-shaped `needs` are cheap.
+    """
     result = []
-    for subjob in job_conf.get('needs', []):
-        for dep in get_deps(job=subjob, root_conf=root_conf):
-            if dep not in result:
-                result.append(dep)
-        result.append(subjob)
+    visited = set()
+
+    def visit(name: str) -> None:
+        for dep in get_needs(root_conf[name]):
+            if dep in visited:
+                continue
+            visited.add(dep)
+            visit(dep)
+            result.append(dep)
+
+    visit(job)
     return result
 
 
-def make_files(files: list, cache_path: str) -> dict:
-    root = Path(cache_path)
+@contextmanager
+def patched_conf(conf_path: Path, root_conf: dict) -> Iterator[None]:
+    """Write the resolved config in-place and restore the original one on exit.
+    """
+    old_content = conf_path.read_text()
+    try:
+        with conf_path.open('w') as stream:
+            yaml.dump(root_conf, stream=stream)
+        yield None
+    finally:
+        conf_path.write_text(old_content)
+
+
+@contextmanager
+def staged_worktree(conf_path: Path, root_conf: dict) -> Iterator[str]:
+    """Create a temporary worktree of HEAD with the resolved config committed into it.
+
+    Yields the directory in the worktree to run `gitlab-runner` from.
+    The commit is made on a detached HEAD, so no branches are changed.
+    """
+    cmd = ['git', 'rev-parse', '--show-prefix']
+    prefix = subprocess.check_output(cmd, universal_newlines=True).strip()
+    conf_rel_path = conf_path.resolve().relative_to(Path.cwd().resolve())
+    with TemporaryDirectory('_gitlab_worktree') as tmp_path:
+        worktree = Path(tmp_path) / 'repo'
+        cmd = ['git', 'worktree', 'add', '--detach', '--quiet', str(worktree), 'HEAD']
+        subprocess.check_call(cmd)
+        try:
+            workdir = worktree / prefix
+            with (workdir / conf_rel_path).open('w') as stream:
+                yaml.dump(root_conf, stream=stream)
+            cmd = [
+                'git',
+                '-c', 'user.name=gitlab-ci-run-job',
+                '-c', 'user.email=gitlab-ci-run-job@localhost',
+                'commit', '--quiet', '--no-verify', '--allow-empty',
+                '-m', 'Resolved Gitlab CI config',
+                '--', str(prefix / conf_rel_path),
+            ]
+            subprocess.check_call(cmd, cwd=str(worktree))
+            yield str(workdir)
+        finally:
+            subprocess.call(['git', 'worktree', 'remove', '--force', str(worktree)])
+
+
+def make_files(files: list, files_path: Path) -> dict:
+    root = files_path
+    root.mkdir(parents=True, exist_ok=True)
     env_vars = dict()
     for line in files:
         var_name, file_path = line.split('=', maxsplit=1)
@@ -149,34 +619,57 @@ if __name__ == '__main__':
     parser.add_argument('--conf', default='.gitlab-ci.yml')
     parser.add_argument('--file', nargs='*', default=[])
     parser.add_argument('--env', nargs='*', default=[])
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--cache-dir', default=str(Path.home() / '.cache' / 'gitlab-ci-run-job'))
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--worktree', action='store_true')
+    parser.add_argument('--report')
     args = parser.parse_args()
     conf_path = Path(args.conf)
 
     # read and fix Gitlab CI root config
-    with conf_path.open() as stream:
-        root_conf = yaml.load(stream=stream, Loader=yaml.SafeLoader)
-    process_root_conf(root_conf)
+    root_conf = ConfResolver(str(conf_path)).resolve()
 
-    old_content = conf_path.read_text()
-    try:
-        with conf_path.open('w') as stream:
-            yaml.dump(root_conf, stream=stream)
+    if args.worktree:
+        conf_context = staged_worktree(conf_path=conf_path, root_conf=root_conf)
+    else:
+        conf_context = patched_conf(conf_path=conf_path, root_conf=root_conf)
+    with conf_context as workdir:
         jobs = get_deps(job=args.job, root_conf=root_conf) + [args.job]
-        with TemporaryDirectory('_gitlab_cache') as cache_path:
+        cache_root = None
+        if not args.no_cache:
+            cache_root = Path(args.cache_dir)
+            cache_root.mkdir(parents=True, exist_ok=True)
+        # keep the working dir on the same file system as the cache,
+        # so artifacts can be moved into the cache and hard-linked from it
+        work_root = str(cache_root) if cache_root is not None else None
+        with TemporaryDirectory('_gitlab_cache', dir=work_root) as cache_path:
+            files_path = Path(cache_path) / 'files'
             env_vars = dict(line.split('=', maxsplit=1) for line in args.env)
-            env_vars.update(make_files(files=args.file, cache_path=cache_path))
+            env_vars.update(make_files(files=args.file, files_path=files_path))
+            retcode, artifacts, stats = run_pipeline(
+                exe=args.exe,
+                jobs=jobs,
+                cache_path=cache_path,
+                root_conf=root_conf,
+                env_vars=env_vars,
+                files_path=files_path,
+                workers=args.jobs,
+                cache_root=cache_root,
+                workdir=workdir,
+            )
+            critical_path = get_critical_path(jobs=jobs, root_conf=root_conf, stats=stats)
+            for job in critical_path:
+                stats[job].critical = True
+            print_report(stats)
+            if args.report:
+                with open(args.report, 'w') as stream:
+                    json.dump(dict(
+                        jobs=[asdict(job_stats) for job_stats in stats.values()],
+                        critical_path=critical_path,
+                        critical_path_time=sum(stats[job].wall_time for job in critical_path),
+                    ), stream, indent=2)
+            if retcode:
+                exit(retcode)
             for job in jobs:
-                print(YELLOW, '-' * 80, RESET)
-                print(f'{YELLOW}# Running {job}{RESET}')
-                retcode = run_job(
-                    exe=args.exe,
-                    job=job,
-                    cache_path=cache_path,
-                    root_conf=root_conf,
-                    env_vars=env_vars,
-                )
-                if retcode:
-                    exit(retcode)
-            save_artifacts(cache_path=cache_path)
-    finally:
-        conf_path.write_text(old_content)
+                save_artifacts(artifacts_path=artifacts[job])
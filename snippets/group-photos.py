@@ -1,33 +1,148 @@
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 import os
 from pathlib import Path
 from random import choice
 import re
 from string import ascii_lowercase
-from PIL import Image
+import struct
+from typing import Iterator
 
 rex = re.compile(r'(PXL|IMG|VID)_(\d{8})_\d+\.(jpg|jpeg|mp4|3gp|avi)')
 rex2 = re.compile(r'20[12]\d[01]\d{3}')
 input_root = Path('input')
 output_root = Path('output')
+PHOTOS = ('.jpg', '.jpeg')
+VIDEOS = ('.mp4', '.3gp', '.avi')
+# EXIF is stored in APP1 segment which is at most 64 KB
+HEADER_SIZE = 64 * 1024
+WORKERS = 32
+QUICKTIME_EPOCH = datetime(1904, 1, 1)
 
 
-def get_date(path: Path) -> str | None:
+def get_exif_date(path: Path) -> str | None:
+    """Get DateTimeOriginal from JPEG EXIF without decoding the image.
+    """
+    with path.open('rb') as stream:
+        data = stream.read(HEADER_SIZE)
+    if data[:2] != b'\xff\xd8':
+        return None
+    # find APP1 segment with EXIF
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xFF:
+        marker = data[pos + 1]
+        size = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        if marker == 0xE1 and data[pos + 4:pos + 10] == b'Exif\x00\x00':
+            return parse_tiff_date(data[pos + 10:pos + 2 + size])
+        # start of scan, no metadata after it
+        if marker == 0xDA:
+            return None
+        pos += 2 + size
+    return None
+
+
+def parse_tiff_date(tiff: bytes) -> str | None:
+    order = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if order is None:
+        return None
+
+    def read_ifd(offset: int) -> dict:
+        """Get offsets of values for all tags in IFD.
+        """
+        entries = dict()
+        if offset + 2 > len(tiff):
+            return entries
+        count = struct.unpack(order + 'H', tiff[offset:offset + 2])[0]
+        for i in range(count):
+            entry = offset + 2 + i * 12
+            if entry + 12 > len(tiff):
+                break
+            tag = struct.unpack(order + 'H', tiff[entry:entry + 2])[0]
+            entries[tag] = entry + 8
+        return entries
+
+    try:
+        ifd0 = read_ifd(struct.unpack(order + 'I', tiff[4:8])[0])
+        if 0x8769 not in ifd0:
+            return None
+        exif_offset = struct.unpack(order + 'I', tiff[ifd0[0x8769]:ifd0[0x8769] + 4])[0]
+        exif = read_ifd(exif_offset)
+        # DateTimeOriginal, ASCII string of 20 bytes, stored by offset
+        if 36867 not in exif:
+            return None
+        value_offset = struct.unpack(order + 'I', tiff[exif[36867]:exif[36867] + 4])[0]
+        date = tiff[value_offset:value_offset + 19].decode('ascii')
+    except (struct.error, UnicodeDecodeError):
+        return None
+    parts = date.split(':')
+    if len(parts) < 2 or not parts[0].isdigit() or parts[0] == '0000':
+        return None
+    return '-'.join(parts[:2])
+
+
+def get_quicktime_date(path: Path) -> str | None:
+    """Get creation time from `mvhd` atom of MP4/3GP/MOV file.
+
+    Only atom headers are read, the rest of the file is skipped.
+    """
+    with path.open('rb') as stream:
+        end = os.fstat(stream.fileno()).st_size
+        pos = 0
+        # find `moov` among top-level atoms, it can be in the end of the file
+        while pos + 8 <= end:
+            stream.seek(pos)
+            size, kind = struct.unpack('>I4s', stream.read(8))
+            header = 8
+            if size == 1:
+                size = struct.unpack('>Q', stream.read(8))[0]
+                header = 16
+            elif size == 0:
+                size = end - pos
+            if size < header:
+                return None
+            if kind == b'moov':
+                break
+            pos += size
+        else:
+            return None
+        # `mvhd` is usually the first atom in `moov`
+        data = stream.read(min(size - header, 4096))
+    inner = 0
+    while inner + 8 <= len(data):
+        size, kind = struct.unpack('>I4s', data[inner:inner + 8])
+        if kind == b'mvhd':
+            version = data[inner + 8]
+            if version == 1:
+                seconds = struct.unpack('>Q', data[inner + 12:inner + 20])[0]
+            else:
+                seconds = struct.unpack('>I', data[inner + 12:inner + 16])[0]
+            if not seconds:
+                return None
+            dt = QUICKTIME_EPOCH + timedelta(seconds=seconds)
+            return f'{dt.year}-{dt.month:02}'
+        if size < 8:
+            return None
+        inner += size
+    return None
+
+
+def get_date(path: Path, mtime: float | None = None) -> str | None:
     match = rex.fullmatch(path.name)
     if match:
         new_stem = match.group(2)
         return new_stem[:4] + '-' + new_stem[4:6]
 
-    if path.suffix == '.jpg':
-        exif = None
-        try:
-            exif = Image.open(path)._getexif()  # type: ignore
-        except Exception:
-            pass
-        if exif:
-            date = exif.get(36867)
-            if date:
-                return '-'.join(date.split(':')[:2])
+    suffix = path.suffix.lower()
+    date = None
+    try:
+        if suffix in PHOTOS:
+            date = get_exif_date(path)
+        elif suffix in ('.mp4', '.3gp'):
+            date = get_quicktime_date(path)
+    except Exception:
+        pass
+    if date:
+        return date
 
     matches = rex2.findall(path.name)
     if len(matches) == 1:
@@ -35,7 +150,9 @@ def get_date(path: Path) -> str | None:
         return new_stem[:4] + '-' + new_stem[4:6]
 
     try:
-        dt = datetime.fromtimestamp(os.path.getmtime(path))
+        if mtime is None:
+            mtime = os.path.getmtime(path)
+        dt = datetime.fromtimestamp(mtime)
         return f'{dt.year}-{dt.month:02}'
     except Exception:
         pass
@@ -43,32 +160,57 @@ def get_date(path: Path) -> str | None:
     return None
 
 
+def walk(root: Path) -> Iterator[os.DirEntry]:
+    """Recursively yield all files in the directory in one `os.scandir` pass.
+    """
+    dirs = [root]
+    while dirs:
+        with os.scandir(dirs.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+
 def add_suffix(path: Path) -> Path:
     suffix = ''.join(choice(ascii_lowercase) for _ in range(6))
     new_name = path.stem + '-' + suffix + path.suffix
     return path.parent / new_name
 
 
+def get_entry_date(entry: os.DirEntry) -> str | None:
+    return get_date(Path(entry.path), mtime=entry.stat().st_mtime)
+
+
 def main():
-    for old_path in input_root.glob("**/*"):
-        new_path = output_root
-        if old_path.suffix.lower() in ('.jpg', '.jpeg'):
-            new_path = new_path / 'photos'
-        elif old_path.suffix.lower() in ('.mp4', '.3gp', '.avi'):
-            new_path = new_path / 'videos'
-        else:
-            print(f'  not a photo: {old_path}')
+    entries = []
+    for entry in walk(input_root):
+        suffix = os.path.splitext(entry.name)[1].lower()
+        if suffix not in PHOTOS + VIDEOS:
+            print(f'  not a photo: {entry.path}')
             continue
-        date = get_date(old_path)
-        if not date:
-            print(f'  no date: {old_path}')
-            continue
-        new_path = new_path / date / old_path.name
-        new_path.parent.mkdir(parents=True, exist_ok=True)
-        if new_path.exists():
-            new_path = add_suffix(new_path)
-        print(f'{old_path} -> {new_path}')
-        os.rename(old_path, new_path)
+        entries.append(entry)
+
+    # reading metadata is I/O bound, so read it from many files at once
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        dates = executor.map(get_entry_date, entries)
+        for entry, date in zip(entries, dates):
+            old_path = Path(entry.path)
+            new_path = output_root
+            if old_path.suffix.lower() in PHOTOS:
+                new_path = new_path / 'photos'
+            else:
+                new_path = new_path / 'videos'
+            if not date:
+                print(f'  no date: {old_path}')
+                continue
+            new_path = new_path / date / old_path.name
+            new_path.parent.mkdir(parents=True, exist_ok=True)
+            if new_path.exists():
+                new_path = add_suffix(new_path)
+            print(f'{old_path} -> {new_path}')
+            os.rename(old_path, new_path)
 
 
 main()
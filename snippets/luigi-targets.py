@@ -2,6 +2,22 @@
 1. Universal base class for luigi targets.
 2. Target for saving pandas.DataFrame to CSV file.
 3. Target for saving numpy.array to CSV file.
+4. Target for saving pandas.DataFrame to Parquet file.
+5. Target for saving pandas.DataFrame to Arrow IPC (Feather) file.
+6. Target for saving numpy.array to binary *.npy file.
+
+All targets write into a temporary file next to the target path
+and rename it into the target path only when the writing is successfully finished.
+So, a crashed task doesn't leave a partial file behind.
+
+If `manifest=True` is passed, a `*.manifest.json` file is saved next to the target
+with the size, modification time, content hash, and schema of the written file.
+Then `exists` checks that the file matches the manifest: if size and modification time
+are the same, the file isn't read at all, and the hash is checked only if mtime changed.
+Use `verify` to force the hash check.
+
+CSV targets transparently compress and decompress files
+with `.gz` (gzip), `.zst` (zstd), or `.lz4` (lz4) suffix.
 
 Example:
 
@@ -11,33 +27,205 @@ with target.open('w') as stream:
     stream.write({'lol': 1, 'lal': 2})
 with target.open('r') as stream:
     dataframe = stream.read()
+for chunk in target.iter_chunks(chunksize=1000, columns=['lol']):
+    print(chunk.lol.sum())
 ```
 
 """
 
+import gzip
+import hashlib
+import json
+import os
+import struct
+import tempfile
 from contextlib import contextmanager
+from itertools import islice
 from pathlib import Path
 
 import pandas
 import numpy
+import pyarrow
+import pyarrow.feather
+import pyarrow.ipc
+import pyarrow.parquet
 from luigi import Target
 
 
+COMPRESSION_SUFFIXES = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+    'lz4': '.lz4',
+}
+
+
+def get_compression(path):
+    """Detect compression by the path suffix.
+    """
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if path.suffix == suffix:
+            return compression
+    return None
+
+
+def open_file(path, mode='rb', compression=None, **kwargs):
+    """Open the file, transparently compressing or decompressing it.
+
+    Supported compressions are `gzip`, `zstd`, and `lz4`.
+    zstandard and lz4 packages are imported only when needed.
+    """
+    if compression is None:
+        return open(str(path), mode, **kwargs)
+    if compression == 'gzip':
+        return gzip.open(str(path), mode, **kwargs)
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.open(str(path), mode, **kwargs)
+    if compression == 'lz4':
+        import lz4.frame
+        return lz4.frame.open(str(path), mode, **kwargs)
+    raise ValueError(f'unsupported compression: {compression}')
+
+
+def make_temp_file(path):
+    """Create an empty temporary file next to `path` and return its fd and path.
+
+    Unlike `tempfile.mkstemp`, the file gets the default permissions (respecting umask)
+    rather than 0600, so the mode is the same as for a file created by `open`.
+    """
+    fd, temp_path = tempfile.mkstemp(
+        dir=str(path.parent),
+        prefix='.' + path.name + '.',
+        suffix='.tmp',
+    )
+    umask = os.umask(0)
+    os.umask(umask)
+    os.fchmod(fd, 0o666 & ~umask)
+    return fd, temp_path
+
+
+def hash_file(path, chunk_size=1 << 20):
+    hasher = hashlib.blake2b()
+    with open(str(path), 'rb') as stream:
+        for chunk in iter(lambda: stream.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
 class BaseTarget(Target):
+    manifest = False
+    _temp_path = None
+
     def exists(self):
-        raise NotImplementedError
+        if not self.manifest:
+            return self.path.exists()
+        manifest = self._read_manifest()
+        if manifest is None:
+            return False
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return False
+        if stat.st_size != manifest['size']:
+            return False
+        if stat.st_mtime_ns == manifest['mtime']:
+            return True
+        # the file was touched, so check if the content is still the same
+        if hash_file(self.path) != manifest['hash']:
+            return False
+        manifest['mtime'] = stat.st_mtime_ns
+        self._write_manifest(manifest)
+        return True
+
+    def verify(self):
+        """Check that the file content matches the manifest hash.
+        """
+        manifest = self._read_manifest()
+        if manifest is None or not self.path.exists():
+            return False
+        return hash_file(self.path) == manifest['hash']
+
+    @property
+    def _manifest_path(self):
+        return self.path.with_name(self.path.name + '.manifest.json')
+
+    def _read_manifest(self):
+        try:
+            with self._manifest_path.open() as stream:
+                return json.load(stream)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_manifest(self, manifest):
+        fd, temp_path = make_temp_file(self._manifest_path)
+        with os.fdopen(fd, 'w') as stream:
+            json.dump(manifest, stream)
+        os.replace(temp_path, str(self._manifest_path))
+
+    def _schema_info(self):
+        """JSON-serializable description of the written data schema.
+        """
+        return None
 
     @contextmanager
     def open(self, mode='rw'):
         try:
             yield self
-        finally:
+        except BaseException:
             if 'w' in mode:
-                self.close()
+                self.abort()
+            raise
+        if 'w' in mode:
+            self.close()
+
+    @property
+    def _write_path(self):
+        """Temporary file next to `path` to write into. `_commit` renames it into `path`.
+        """
+        if self._temp_path is None:
+            fd, temp_path = make_temp_file(self.path)
+            os.close(fd)
+            self._temp_path = Path(temp_path)
+        return self._temp_path
+
+    def _commit(self):
+        if not self.manifest:
+            os.replace(str(self._write_path), str(self.path))
+            self._temp_path = None
+            return
+        content_hash = hash_file(self._write_path)
+        # drop the old manifest first, so it never describes the new file by mistake
+        if self._manifest_path.exists():
+            self._manifest_path.unlink()
+        os.replace(str(self._write_path), str(self.path))
+        self._temp_path = None
+        stat = self.path.stat()
+        self._write_manifest(dict(
+            size=stat.st_size,
+            mtime=stat.st_mtime_ns,
+            hash=content_hash,
+            schema=self._schema_info(),
+        ))
+
+    def abort(self):
+        """Drop everything written so far, leaving `path` untouched.
+        """
+        if self._temp_path is not None:
+            if self._temp_path.exists():
+                self._temp_path.unlink()
+            self._temp_path = None
 
     def read(self):
         raise NotImplementedError
 
+    def iter_chunks(self, chunksize=10000, columns=None, dtypes=None):
+        """Lazily read the data by chunks of at most `chunksize` rows.
+
+        Only the given `columns` are loaded, and converted into `dtypes` if passed.
+        Stopping the iteration early doesn't read the rest of the file.
+        """
+        raise NotImplementedError
+
     def write(self, data):
         raise NotImplementedError
 
@@ -45,57 +233,409 @@ class BaseTarget(Target):
         pass
 
 
-class DataFrameCSVTarget(BaseTarget):
+class BaseDataFrameTarget(BaseTarget):
+    """Base class for targets writing pandas.DataFrame by chunks.
+
+    `write` accepts a row (dict), a list of rows, or a DataFrame.
+    Rows are buffered and passed into `_write_frame` by chunks of `chunksize` rows,
+    DataFrames are passed right away. So, only one chunk is kept in memory.
+    """
+
+    def write(self, data):
+        if isinstance(data, pandas.DataFrame):
+            self._flush()
+            self._write_frame(data)
+            return
+        if isinstance(data, dict):
+            self._rows.append(data)
+        else:
+            self._rows.extend(data)
+        if len(self._rows) >= self.chunksize:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        frame = pandas.DataFrame(self._rows)
+        self._rows = []
+        self._write_frame(frame)
+
+    def _write_frame(self, frame):
+        raise NotImplementedError
+
+    @staticmethod
+    def _align_columns(frame, columns):
+        """Reorder columns of the frame as `columns`, filling missing ones with NaN.
+
+        Raises ValueError for columns not in `columns` instead of dropping their data.
+        """
+        unknown = [column for column in frame.columns if column not in columns]
+        if unknown:
+            raise ValueError(f'unknown columns (not in the first chunk): {unknown}')
+        return frame.reindex(columns=columns)
+
+
+class DataFrameCSVTarget(BaseDataFrameTarget):
     """Save pandas.DataFrame objects to one *.csv file.
+
+    Chunks are appended to the file as they come.
+    All chunks are written with columns of the first one, new columns aren't allowed.
     """
 
-    def __init__(self, path, name=None):
+    def __init__(self, path, name=None, chunksize=10000, compression=None, manifest=False):
         if isinstance(path, str):
             path = Path(path)
         if name is not None:
-            path /= name + '.csv'
+            path /= name + '.csv' + COMPRESSION_SUFFIXES.get(compression, '')
         self.path = path
-        self.dataframe = pandas.DataFrame()
-
-    def exists(self):
-        return self.path.exists()
+        self.manifest = manifest
+        self.compression = compression or get_compression(path)
+        self.chunksize = chunksize
+        self._rows = []
+        self._columns = None
+        self._stream = None
 
     def read(self):
-        return pandas.read_csv(str(self.path))
+        with open_file(self.path, 'rt', compression=self.compression, newline='') as stream:
+            return pandas.read_csv(stream)
 
-    def write(self, data):
-        self.dataframe.append(data)
+    def iter_chunks(self, chunksize=10000, columns=None, dtypes=None):
+        with open_file(self.path, 'rt', compression=self.compression, newline='') as stream:
+            reader = pandas.read_csv(stream, chunksize=chunksize, usecols=columns, dtype=dtypes)
+            with reader:
+                yield from reader
+
+    def _write_frame(self, frame):
+        if self._stream is None:
+            self._stream = open_file(
+                self._write_path, 'wt', compression=self.compression, newline='',
+            )
+        if self._columns is None:
+            self._columns = list(frame.columns)
+            header = True
+        else:
+            frame = self._align_columns(frame, self._columns)
+            header = False
+        frame.to_csv(self._stream, header=header, index=False)
 
     def close(self):
-        self.dataframe.to_csv(str(self.path))
+        self._flush()
+        # nothing was written, so don't replace the existing file
+        if self._stream is None:
+            return
+        self._stream.close()
+        self._stream = None
+        self._commit()
+
+    def _schema_info(self):
+        return self._columns
+
+    def abort(self):
+        self._rows = []
+        self._columns = None
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        super().abort()
 
 
 class NumPyCSVTarget(BaseTarget):
     """Save numpy.array to *.csv file.
     """
 
-    def __init__(self, path, name=None):
+    def __init__(self, path, name=None, compression=None, manifest=False):
         if isinstance(path, str):
             path = Path(path)
         if name is not None:
-            path /= name + '.csv'
+            path /= name + '.csv' + COMPRESSION_SUFFIXES.get(compression, '')
         self.path = path
-
-    def exists(self):
-        return self.path.exists()
+        self.manifest = manifest
+        self.compression = compression or get_compression(path)
+        self._shape = None
 
     def read(self):
-        return numpy.genfromtxt(str(self.path), delimiter=',')
+        with open_file(self.path, 'rt', compression=self.compression) as stream:
+            return numpy.genfromtxt(stream, delimiter=',')
+
+    def iter_chunks(self, chunksize=10000, columns=None, dtypes=None):
+        with open_file(self.path, 'rt', compression=self.compression) as stream:
+            lines = (line for line in stream if not line.startswith('#'))
+            while True:
+                chunk = list(islice(lines, chunksize))
+                if not chunk:
+                    return
+                yield numpy.loadtxt(
+                    chunk,
+                    delimiter=',',
+                    usecols=columns,
+                    dtype=dtypes or float,
+                    ndmin=2,
+                )
 
     def write(self, data, header=None):
         delimiter = ','
         if isinstance(header, (list, tuple)):
             header = delimiter.join(header)
-        numpy.savetxt(
-            str(self.path),
-            data,
-            fmt='%.18e',
-            delimiter=delimiter,
-            newline='\n',
-            header=header,
+        if header is None:
+            header = ''
+        self._shape = numpy.shape(data)
+        try:
+            with open_file(self._write_path, 'wt', compression=self.compression) as stream:
+                numpy.savetxt(
+                    stream,
+                    data,
+                    fmt='%.18e',
+                    delimiter=delimiter,
+                    newline='\n',
+                    header=header,
+                )
+        except BaseException:
+            self.abort()
+            raise
+        self._commit()
+
+    def _schema_info(self):
+        return dict(shape=self._shape)
+
+
+class NumPyBinaryTarget(BaseTarget):
+    """Save numpy.array to binary *.npy file.
+
+    Every `write` appends the array to the file along axis 0,
+    so all arrays must have the same dtype (or safely castable into the dtype of the first one)
+    and the same shape except the first axis.
+    `read` returns numpy.memmap, so the data is paged from disk only when accessed.
+    """
+
+    def __init__(self, path, name=None, manifest=False):
+        if isinstance(path, str):
+            path = Path(path)
+        if name is not None:
+            path /= name + '.npy'
+        self.path = path
+        self.manifest = manifest
+        self._stream = None
+        self._dtype = None
+        self._shape = None
+        self._rows = 0
+        self._header_size = 0
+
+    def read(self, mode='r'):
+        return numpy.load(str(self.path), mmap_mode=mode)
+
+    def iter_chunks(self, chunksize=10000, columns=None, dtypes=None):
+        array = self.read()
+        for start in range(0, len(array), chunksize):
+            chunk = array[start:start + chunksize]
+            if columns is not None:
+                chunk = chunk[:, columns]
+            if dtypes is not None:
+                chunk = chunk.astype(dtypes)
+            yield chunk
+
+    def _header_dict(self, rows):
+        return repr(dict(
+            descr=numpy.lib.format.dtype_to_descr(self._dtype),
+            fortran_order=False,
+            shape=(rows, ) + self._shape,
+        ))
+
+    def _header(self, rows):
+        if not self._header_size:
+            # Reserve enough space for any rows count,
+            # so the header can be rewritten in-place when the file is closed.
+            max_size = 10 + len(self._header_dict(2 ** 64)) + 1
+            self._header_size = -(-max_size // 64) * 64
+        header = self._header_dict(rows).ljust(self._header_size - 10 - 1) + '\n'
+        return numpy.lib.format.magic(1, 0) + struct.pack('<H', len(header)) + header.encode('latin1')
+
+    def write(self, data):
+        data = numpy.asarray(data)
+        if data.ndim == 0:
+            raise ValueError('cannot append a scalar')
+        if self._stream is None:
+            self._dtype = data.dtype
+            self._shape = data.shape[1:]
+            self._stream = self._write_path.open('wb')
+            self._stream.write(self._header(0))
+        if data.shape[1:] != self._shape:
+            raise ValueError(f'expected {self._shape} shape after axis 0, got {data.shape[1:]}')
+        if not numpy.can_cast(data.dtype, self._dtype, casting='safe'):
+            raise ValueError(f'cannot safely cast {data.dtype} into {self._dtype}')
+        data = numpy.ascontiguousarray(data, dtype=self._dtype)
+        data.tofile(self._stream)
+        self._rows += data.shape[0]
+
+    def close(self):
+        if self._stream is None:
+            return
+        self._stream.seek(0)
+        self._stream.write(self._header(self._rows))
+        self._stream.close()
+        self._stream = None
+        self._commit()
+
+    def _schema_info(self):
+        if self._dtype is None:
+            return None
+        return dict(
+            descr=numpy.lib.format.dtype_to_descr(self._dtype),
+            shape=(self._rows, ) + self._shape,
         )
+
+    def abort(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        self._dtype = None
+        self._shape = None
+        self._rows = 0
+        self._header_size = 0
+        super().abort()
+
+
+class DataFrameParquetTarget(BaseDataFrameTarget):
+    """Save pandas.DataFrame objects to one *.parquet file.
+
+    Every chunk is written as one or more row groups of at most `row_group_size` rows.
+    All chunks are written with the schema of the first one, new columns aren't allowed.
+    `read` can load only the given `columns` and skip row groups
+    not matching `filters` (see `pyarrow.parquet.read_table`).
+    """
+
+    def __init__(
+        self, path, name=None, chunksize=100000, row_group_size=100000,
+        compression='snappy', manifest=False,
+    ):
+        if isinstance(path, str):
+            path = Path(path)
+        if name is not None:
+            path /= name + '.parquet'
+        self.path = path
+        self.manifest = manifest
+        self.chunksize = chunksize
+        self._rows = []
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self._schema = None
+        self._writer = None
+
+    def read(self, columns=None, filters=None):
+        table = pyarrow.parquet.read_table(str(self.path), columns=columns, filters=filters)
+        return table.to_pandas()
+
+    def iter_chunks(self, chunksize=10000, columns=None, dtypes=None):
+        with pyarrow.parquet.ParquetFile(str(self.path)) as parquet_file:
+            for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+                frame = batch.to_pandas()
+                if dtypes is not None:
+                    frame = frame.astype(dtypes)
+                yield frame
+
+    def _write_frame(self, frame):
+        if self._writer is None:
+            table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+            self._schema = table.schema
+            self._writer = pyarrow.parquet.ParquetWriter(
+                str(self._write_path),
+                self._schema,
+                compression=self.compression,
+            )
+        else:
+            frame = self._align_columns(frame, self._schema.names)
+            table = pyarrow.Table.from_pandas(frame, schema=self._schema, preserve_index=False)
+        self._writer.write_table(table, row_group_size=self.row_group_size)
+
+    def close(self):
+        self._flush()
+        # nothing was written, so don't replace the existing file
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        self._commit()
+
+    def _schema_info(self):
+        if self._schema is None:
+            return None
+        return {field.name: str(field.type) for field in self._schema}
+
+    def abort(self):
+        self._rows = []
+        self._schema = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        super().abort()
+
+
+class DataFrameFeatherTarget(BaseDataFrameTarget):
+    """Save pandas.DataFrame objects to one *.feather (Arrow IPC) file.
+
+    All chunks are written with the schema of the first one, new columns aren't allowed.
+    `read` memory-maps the file and can load only the given `columns`.
+    """
+
+    def __init__(self, path, name=None, chunksize=100000, compression='lz4', manifest=False):
+        if isinstance(path, str):
+            path = Path(path)
+        if name is not None:
+            path /= name + '.feather'
+        self.path = path
+        self.manifest = manifest
+        self.chunksize = chunksize
+        self._rows = []
+        self.compression = compression
+        self._schema = None
+        self._writer = None
+
+    def read(self, columns=None):
+        table = pyarrow.feather.read_table(str(self.path), columns=columns, memory_map=True)
+        return table.to_pandas()
+
+    def iter_chunks(self, chunksize=10000, columns=None, dtypes=None):
+        # Chunks don't cross record batches, so some chunks can be smaller than `chunksize`.
+        with pyarrow.memory_map(str(self.path)) as source:
+            reader = pyarrow.ipc.open_file(source)
+            for index in range(reader.num_record_batches):
+                batch = reader.get_batch(index)
+                if columns is not None:
+                    batch = batch.select(columns)
+                for start in range(0, batch.num_rows, chunksize):
+                    frame = batch.slice(start, chunksize).to_pandas()
+                    if dtypes is not None:
+                        frame = frame.astype(dtypes)
+                    yield frame
+
+    def _write_frame(self, frame):
+        if self._writer is None:
+            table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+            self._schema = table.schema
+            options = pyarrow.ipc.IpcWriteOptions(compression=self.compression)
+            self._writer = pyarrow.ipc.new_file(str(self._write_path), self._schema, options=options)
+        else:
+            frame = self._align_columns(frame, self._schema.names)
+            table = pyarrow.Table.from_pandas(frame, schema=self._schema, preserve_index=False)
+        self._writer.write_table(table)
+
+    def close(self):
+        self._flush()
+        # nothing was written, so don't replace the existing file
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        self._commit()
+
+    def _schema_info(self):
+        if self._schema is None:
+            return None
+        return {field.name: str(field.type) for field in self._schema}
+
+    def abort(self):
+        self._rows = []
+        self._schema = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        super().abort()
@@ -6,48 +6,196 @@ Usage:
     1. "Export chat history" from the desktop client.
     2. Open "ChatExport*" directory.
     3. Run the script from the directory.
+
+Export files are processed in parallel by `WORKERS` processes.
+
+Words are ranked for every user by how distinctive they are for the user
+compared to all other users. `SCORING` can be:
+
+    + `log-odds`: log-odds ratio with informative Dirichlet prior (Monroe et al., 2008).
+    + `tfidf`: word frequency for the user weighted by the inverse users frequency.
+
+Words said by the user less than `MIN_COUNT` times are ignored.
+For `log-odds`, words with z-score below `MIN_SCORE` are ignored as well.
 """
 
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from collections import defaultdict, Counter
-from lxml import html
+from lxml import etree
+from scipy import sparse
+import numpy
+import os
 import re
 
 
+COUNT = 30
+WORKERS = os.cpu_count() or 1
+SCORING = 'log-odds'
+MIN_COUNT = 2
+# total weight of the prior for log-odds scoring, relative to the corpus size
+PRIOR = 0.01
+# min log-odds z-score for a word to be distinctive, 1.96 is 95% confidence
+MIN_SCORE = 1.96
+
 rex = re.compile(r'\W+')
-counters = defaultdict(Counter)
 
-for path in Path().glob('*.html'):
-    tree = html.fromstring(open('messages.html').read())
-    user = ''
-    for msg in tree.xpath('//div[@class="body"]'):
-        divs = msg.xpath('div[@class="from_name"]')
-        if divs:
-            user = divs[0].text.strip() or user
-        divs = msg.xpath('div[@class="text"]')
-        if not divs:
+
+def iter_messages(path: Path, user: str = ''):
+    """Yield (user, text) for every message in the export file.
+
+    The file is parsed as a stream, and parsed elements are dropped
+    as soon as they're processed, so memory stays flat on huge exports.
+    `user` is the author of the messages before the first `from_name`.
+    `text` is None for messages without text (photos, stickers, etc.),
+    they're yielded anyway to keep track of the author.
+    """
+    for _, elem in etree.iterparse(str(path), events=('end',), tag='div', html=True):
+        classes = (elem.get('class') or '').split()
+        # forwarded messages are nested `div.forwarded.body`, their author isn't the sender
+        if classes == ['body']:
+            text = None
+            for child in elem:
+                if child.get('class') == 'from_name':
+                    user = (child.text or '').strip() or user
+                elif child.get('class') == 'text':
+                    text = ''.join(child.itertext()).strip()
+            yield user, text
+        elif 'message' in classes:
+            elem.clear()
+            # drop already processed messages from the tree
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+
+def get_file_number(path: Path) -> int:
+    # messages.html, messages2.html, messages3.html, ...
+    return int(path.stem[len('messages'):] or 1)
+
+
+def count_words(path: Path):
+    """Count words said by every user in one export file.
+
+    Words from messages at the beginning of the file with unknown author
+    (it's in the previous file) are counted for `None` user.
+    Returns the counters and the author of the last message (with or without text).
+    """
+    counters = defaultdict(Counter)
+    user = None
+    for user, msg in iter_messages(path, user=None):
+        if msg is None:
             continue
-        msg = divs[0].text.strip()
-        # print(user, msg)
-        words = msg.lower().split()
-        words = [rex.sub('', word) for word in words]
-        counters[user].update(Counter(words))
+        # count words right into the user counter without making a Counter per message
+        counters[user].update(rex.sub('', word) for word in msg.lower().split())
+    return dict(counters), user
 
 
-COUNT = 30
+def make_matrix(counters: dict):
+    """Make users-by-words sparse matrix of word counts.
+    """
+    users = sorted(counters)
+    vocabulary = dict()
+    rows = []
+    cols = []
+    data = []
+    for row, user in enumerate(users):
+        for word, count in counters[user].items():
+            if not word:
+                continue
+            rows.append(row)
+            cols.append(vocabulary.setdefault(word, len(vocabulary)))
+            data.append(count)
+    shape = (len(users), len(vocabulary))
+    matrix = sparse.csr_matrix((data, (rows, cols)), shape=shape, dtype=numpy.float64)
+    words = numpy.empty(len(vocabulary), dtype=object)
+    for word, col in vocabulary.items():
+        words[col] = word
+    return users, words, matrix
+
+
+def score_tfidf(matrix):
+    # how many users said every word
+    users_freq = numpy.bincount(matrix.indices, minlength=matrix.shape[1])
+    idf = numpy.log(matrix.shape[0] / users_freq)
+    totals = numpy.asarray(matrix.sum(axis=1)).ravel()
+    rows = numpy.repeat(numpy.arange(matrix.shape[0]), numpy.diff(matrix.indptr))
+    return matrix.data / totals[rows] * idf[matrix.indices]
+
+
+def score_log_odds(matrix):
+    """z-scores of log-odds ratio of every word for the user vs all other users.
+
+    Only the words used by the user are scored, so it's computed on the sparse data.
+    """
+    rows = numpy.repeat(numpy.arange(matrix.shape[0]), numpy.diff(matrix.indptr))
+    word_totals = numpy.asarray(matrix.sum(axis=0)).ravel()
+    user_totals = numpy.asarray(matrix.sum(axis=1)).ravel()
+    total = word_totals.sum()
+    # informative prior: word frequencies in the whole chat
+    alpha = word_totals * PRIOR
+    alpha0 = total * PRIOR
+
+    counts = matrix.data
+    prior = alpha[matrix.indices]
+    rest_counts = word_totals[matrix.indices] - counts
+    user_sizes = user_totals[rows]
+    rest_sizes = total - user_sizes
 
+    user_odds = numpy.log(counts + prior) - numpy.log(user_sizes + alpha0 - counts - prior)
+    rest_odds = numpy.log(rest_counts + prior) - numpy.log(rest_sizes + alpha0 - rest_counts - prior)
+    variance = 1 / (counts + prior) + 1 / (rest_counts + prior)
+    return (user_odds - rest_odds) / numpy.sqrt(variance)
+
+
+def get_top_words(counters: dict, count: int) -> dict:
+    """Get `count` most distinctive words for every user.
+    """
+    users, words, matrix = make_matrix(counters)
+    if SCORING == 'tfidf':
+        scores = score_tfidf(matrix)
+        min_score = 0
+    elif SCORING == 'log-odds':
+        scores = score_log_odds(matrix)
+        min_score = MIN_SCORE
+    else:
+        raise ValueError(f'unknown scoring: {SCORING}')
+    scores[matrix.data < MIN_COUNT] = -numpy.inf
+
+    top_words = dict()
+    for row, user in enumerate(users):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        user_scores = scores[start:end]
+        k = min(count, end - start)
+        # partial sort: select top k in linear time and sort only them
+        top = numpy.argpartition(-user_scores, k - 1)[:k] if k else []
+        top = sorted(top, key=lambda i: -user_scores[i])
+        cols = matrix.indices[start:end]
+        # words with low score aren't (significantly) more common for the user than for others
+        top_words[user] = [words[cols[i]] for i in top if user_scores[i] > min_score]
+    return top_words
+
+
+def main():
+    paths = sorted(Path().glob('messages*.html'), key=get_file_number)
+    if WORKERS > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=WORKERS) as executor:
+            results = list(executor.map(count_words, paths))
+    else:
+        results = map(count_words, paths)
+
+    # merge counters of all files in order,
+    # so messages with unknown author go to the last author in the previous file
+    counters = defaultdict(Counter)
+    user = ''
+    for file_counters, last_user in results:
+        for file_user, counter in file_counters.items():
+            counters[user if file_user is None else file_user].update(counter)
+        user = last_user or user
 
-all_top_words = defaultdict(int)
-for counter in counters.values():
-    for word, _ in counter.most_common(COUNT):
-        all_top_words[word] += 1
+    top_words = get_top_words(counters, count=COUNT)
+    for name, words in sorted(top_words.items()):
+        print(name + ':', ', '.join(words))
 
-top_words = dict()
-for name, counter in counters.items():
-    top_words[name] = []
-    for word, _ in counter.most_common(COUNT):
-        if all_top_words[word] == 1:
-            top_words[name].append(word)
 
-for name, words in sorted(top_words.items()):
-    print(name + ':', ', '.join(words))
+if __name__ == '__main__':
+    main()